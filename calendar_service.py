@@ -3,14 +3,49 @@ Google Calendar service module for GCal Extractor.
 Handles calendar discovery, selection, and configuration persistence.
 """
 
-import json
 import os
-from typing import List, Dict, Optional
+from functools import lru_cache
+from typing import Iterator, List, Dict, Optional, Tuple
 import streamlit as st
+import json_utils
 from google_auth import GoogleAuth
 
 CONFIG_FILE = 'config.json'
 
+# Seconds to keep the calendar list before asking Google again
+CALENDAR_LIST_TTL = 300
+
+# Maximum number of calls Google accepts in one batch HTTP request
+MAX_BATCH_SIZE = 50
+
+
+@st.cache_data(ttl=CALENDAR_LIST_TTL, show_spinner=False)
+def _fetch_calendar_list(user_key: str, _service) -> List[Dict]:
+    """
+    Fetch all calendar list entries, following pagination.
+    
+    Cached per user so Streamlit reruns don't hit the API again;
+    `_service` is excluded from the cache key.
+    """
+    calendars = []
+    page_token = None
+    while True:
+        calendars_result = _service.calendarList().list(
+            maxResults=250,
+            pageToken=page_token
+        ).execute()
+        calendars.extend(calendars_result.get('items', []))
+        
+        page_token = calendars_result.get('nextPageToken')
+        if not page_token:
+            return calendars
+
+
+@lru_cache(maxsize=16)
+def _build_calendar_options(calendars: Tuple[Tuple[str, str], ...]) -> Dict[str, str]:
+    """Build the calendar ID to display name mapping for the selection widget."""
+    return {calendar_id: f"{name}" for calendar_id, name in calendars}
+
 
 class CalendarService:
     """Handles Google Calendar operations and configuration."""
@@ -22,16 +57,16 @@ class CalendarService:
     
     def load_config(self):
         """Load calendar configuration from config file."""
-        if os.path.exists(CONFIG_FILE):
-            try:
-                with open(CONFIG_FILE, 'r') as f:
-                    config = json.load(f)
-                    self.selected_calendars = config.get('selected_calendars', [])
-                return True
-            except Exception as e:
-                st.error(f"Error loading configuration: {e}")
-                return False
-        return False
+        try:
+            with open(CONFIG_FILE, 'rb') as f:
+                config = json_utils.loads(f.read())
+                self.selected_calendars = config.get('selected_calendars', [])
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            st.error(f"Error loading configuration: {e}")
+            return False
     
     def save_config(self):
         """Save calendar configuration to config file."""
@@ -39,8 +74,7 @@ class CalendarService:
             config = {
                 'selected_calendars': self.selected_calendars
             }
-            with open(CONFIG_FILE, 'w') as f:
-                json.dump(config, f, indent=2)
+            json_utils.write_atomic(CONFIG_FILE, json_utils.dumps(config, indent=True))
             return True
         except Exception as e:
             st.error(f"Error saving configuration: {e}")
@@ -53,8 +87,7 @@ class CalendarService:
             return None
         
         try:
-            calendars_result = service.calendarList().list().execute()
-            calendars = calendars_result.get('items', [])
+            calendars = _fetch_calendar_list(self.auth.get_cache_key(), service)
             
             # Format calendar data for easier handling
             formatted_calendars = []
@@ -105,8 +138,13 @@ class CalendarService:
         """Clear calendar configuration."""
         try:
             self.selected_calendars = []
-            if os.path.exists(CONFIG_FILE):
+            st.session_state.pop('events_cache', None)
+            st.session_state.pop('report_bytes', None)
+            st.session_state.pop('report_name', None)
+            try:
                 os.remove(CONFIG_FILE)
+            except FileNotFoundError:
+                pass
             return True
         except Exception as e:
             st.error(f"Error clearing configuration: {e}")
@@ -118,16 +156,17 @@ class CalendarService:
         
         # Get available calendars
         available_calendars = self.get_available_calendars()
-        if not available_calendars:
+        if available_calendars is None:
             st.error("Unable to fetch calendars. Please check your connection and try again.")
             return False
-        
-        if not available_calendars:
+        elif not available_calendars:
             st.warning("No calendars found in your Google account.")
             return False
         
         # Create multiselect for calendar selection
-        calendar_options = {cal['id']: f"{cal['name']}" for cal in available_calendars}
+        calendar_options = _build_calendar_options(
+            tuple((cal['id'], cal['name']) for cal in available_calendars)
+        )
         
         # Get currently selected calendar IDs
         current_selection = [cal['id'] for cal in self.selected_calendars]
@@ -169,58 +208,84 @@ class CalendarService:
         """Get mapping of calendar IDs to display names."""
         return {cal['id']: cal['name'] for cal in self.selected_calendars}
     
-    def fetch_events(self, year: int, month: int) -> Optional[List[Dict]]:
-        """Fetch calendar events for specified month and year."""
+    def fetch_events_streaming(self, year: int, month: int,
+                               failed_calendars: Optional[List[str]] = None) -> Iterator[List[Dict]]:
+        """
+        Fetch calendar events for specified month and year, one page at a time.
+        
+        Pages are yielded as each batch request completes, so callers can
+        process them without holding the whole month in memory. Errors for a
+        single calendar are reported and skipped, and the calendar's ID is
+        appended to `failed_calendars` when given; other API errors are raised.
+        """
         service = self.auth.get_calendar_service()
         if not service:
-            return None
+            raise RuntimeError("Google Calendar service is not available")
         
-        try:
-            # Calculate date range for the month
-            from datetime import datetime, timedelta
-            import calendar as cal_module
-            
-            # First day of the month
-            start_date = datetime(year, month, 1)
-            
-            # Last day of the month
-            last_day = cal_module.monthrange(year, month)[1]
-            end_date = datetime(year, month, last_day, 23, 59, 59)
-            
-            # Convert to RFC3339 format
-            time_min = start_date.isoformat() + 'Z'
-            time_max = end_date.isoformat() + 'Z'
-            
-            all_events = []
+        # Calculate date range for the month
+        from datetime import datetime, timedelta
+        import calendar as cal_module
+        
+        # First day of the month
+        start_date = datetime(year, month, 1)
+        
+        # Last day of the month
+        last_day = cal_module.monthrange(year, month)[1]
+        end_date = datetime(year, month, last_day, 23, 59, 59)
+        
+        # Convert to RFC3339 format
+        time_min = start_date.isoformat() + 'Z'
+        time_max = end_date.isoformat() + 'Z'
+        
+        calendar_names = self.get_calendar_display_names()
+        
+        # Page token still to fetch for each calendar (None = first page)
+        pending_pages = {calendar['id']: None for calendar in self.selected_calendars}
+        
+        # Fetch events from all selected calendars, batching one
+        # events().list call per calendar into a single HTTP request
+        while pending_pages:
+            pending_items = list(pending_pages.items())
+            pending_pages = {}
             
-            # Fetch events from all selected calendars
-            for calendar in self.selected_calendars:
-                calendar_id = calendar['id']
-                calendar_name = calendar['name']
+            for batch_start in range(0, len(pending_items), MAX_BATCH_SIZE):
+                batch_items = pending_items[batch_start:batch_start + MAX_BATCH_SIZE]
+                pages = []
                 
-                try:
-                    events_result = service.events().list(
-                        calendarId=calendar_id,
-                        timeMin=time_min,
-                        timeMax=time_max,
-                        singleEvents=True,
-                        orderBy='startTime'
-                    ).execute()
+                def handle_response(request_id, response, exception, batch_items=batch_items, pages=pages):
+                    calendar_id = batch_items[int(request_id)][0]
+                    calendar_name = calendar_names[calendar_id]
                     
-                    events = events_result.get('items', [])
+                    if exception is not None:
+                        st.error(f"Error fetching events from calendar '{calendar_name}': {exception}")
+                        if failed_calendars is not None:
+                            failed_calendars.append(calendar_id)
+                        return
                     
                     # Add calendar info to each event
+                    events = response.get('items', [])
                     for event in events:
                         event['calendar_id'] = calendar_id
                         event['calendar_name'] = calendar_name
-                        all_events.append(event)
-                        
-                except Exception as e:
-                    st.error(f"Error fetching events from calendar '{calendar_name}': {e}")
-                    continue
-            
-            return all_events
-            
-        except Exception as e:
-            st.error(f"Error fetching calendar events: {e}")
-            return None
+                    pages.append(events)
+                    
+                    if response.get('nextPageToken'):
+                        pending_pages[calendar_id] = response['nextPageToken']
+                
+                batch = service.new_batch_http_request(callback=handle_response)
+                for index, (calendar_id, page_token) in enumerate(batch_items):
+                    batch.add(
+                        service.events().list(
+                            calendarId=calendar_id,
+                            timeMin=time_min,
+                            timeMax=time_max,
+                            singleEvents=True,
+                            orderBy='startTime',
+                            maxResults=2500,
+                            pageToken=page_token
+                        ),
+                        request_id=str(index)
+                    )
+                batch.execute()
+                
+                yield from pages
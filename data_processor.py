@@ -3,11 +3,56 @@ Data processing module for GCal Extractor.
 Handles patient name normalization, event processing, and data aggregation.
 """
 
-from typing import List, Dict, Tuple
+from typing import Iterable, List, Dict, Tuple
+from collections import defaultdict
+from functools import lru_cache
 import re
 from datetime import datetime
 import streamlit as st
 
+# Collapses runs of whitespace inside patient names
+_WS_RE = re.compile(r'\s+')
+
+# Matches "Padres de [Name]" event titles
+_PADRES_RE = re.compile(r'^Padres\s+de\s+(.+)$', re.IGNORECASE)
+
+
+# Titles repeat across a patient's sessions, so name parsing is memoized
+@lru_cache(maxsize=4096)
+def _normalize_patient_name(name: str) -> str:
+    """Normalize patient name by capitalizing and trimming spaces."""
+    if not name:
+        return ""
+    
+    # Remove leading/trailing spaces and capitalize
+    normalized = name.strip().title()
+    
+    # Handle multiple spaces between words
+    normalized = _WS_RE.sub(' ', normalized)
+    
+    return normalized
+
+
+@lru_cache(maxsize=4096)
+def _extract_patient_name(event_title: str) -> Tuple[str, bool]:
+    """Extract (patient_name, is_parent_session) from an event title."""
+    if not event_title:
+        return "", False
+    
+    # Check for "Padres de [Name]" pattern, skipping the regex for
+    # the common case of titles that don't start with "padres"
+    match = None
+    if event_title[:6].lower() == 'padres':
+        match = _PADRES_RE.match(event_title)
+    
+    if match:
+        # Extract the patient name from "Padres de [Name]"
+        patient_name = match.group(1)
+        return _normalize_patient_name(patient_name), True
+    else:
+        # Regular patient session
+        return _normalize_patient_name(event_title), False
+
 
 class DataProcessor:
     """Handles processing of calendar events into patient consultation data."""
@@ -17,16 +62,7 @@ class DataProcessor:
     
     def normalize_patient_name(self, name: str) -> str:
         """Normalize patient name by capitalizing and trimming spaces."""
-        if not name:
-            return ""
-        
-        # Remove leading/trailing spaces and capitalize
-        normalized = name.strip().title()
-        
-        # Handle multiple spaces between words
-        normalized = re.sub(r'\s+', ' ', normalized)
-        
-        return normalized
+        return _normalize_patient_name(name)
     
     def extract_patient_name(self, event_title: str) -> Tuple[str, bool]:
         """
@@ -37,22 +73,9 @@ class DataProcessor:
         - "Padres de Sofia M" returns ("Sofia M", True)
         - "Juan Perez" returns ("Juan Perez", False)
         """
-        if not event_title:
-            return "", False
-        
-        # Check for "Padres de [Name]" pattern
-        padres_pattern = r'^Padres\s+de\s+(.+)$'
-        match = re.match(padres_pattern, event_title, re.IGNORECASE)
-        
-        if match:
-            # Extract the patient name from "Padres de [Name]"
-            patient_name = match.group(1)
-            return self.normalize_patient_name(patient_name), True
-        else:
-            # Regular patient session
-            return self.normalize_patient_name(event_title), False
+        return _extract_patient_name(event_title)
     
-    def process_events(self, events: List[Dict]) -> Dict[str, Dict]:
+    def process_events(self, events: Iterable[Dict]) -> Dict[str, Dict]:
         """
         Process calendar events into structured patient data.
         
@@ -62,10 +85,10 @@ class DataProcessor:
                 'calendar_name': 'Calendar Name',
                 'patients': {
                     'Patient Name': {
-                        'total_sessions': int,
                         'sessions': [
                             {
                                 'date': 'dd/mm/yyyy',
+                                'sort_key': int (date ordinal),
                                 'title': 'Event Title',
                                 'is_parent_session': bool
                             }
@@ -75,7 +98,10 @@ class DataProcessor:
             }
         }
         """
-        processed_data = {}
+        processed_data = defaultdict(lambda: {
+            'calendar_name': None,
+            'patients': defaultdict(lambda: {'sessions': []})
+        })
         
         for event in events:
             # Skip events without titles
@@ -87,48 +113,44 @@ class DataProcessor:
             calendar_name = event['calendar_name']
             
             # Extract start date
-            start = event.get('start', {})
-            if 'dateTime' in start:
+            start = event.get('start')
+            if start is None:
+                continue  # Skip events without valid dates
+            
+            date_time = start.get('dateTime')
+            if date_time is not None:
                 # Full datetime event
-                event_date = datetime.fromisoformat(start['dateTime'].replace('Z', '+00:00'))
-            elif 'date' in start:
-                # All-day event
-                event_date = datetime.strptime(start['date'], '%Y-%m-%d')
+                event_date = datetime.fromisoformat(date_time.replace('Z', '+00:00'))
             else:
-                continue  # Skip events without valid dates
+                # All-day event
+                date = start.get('date')
+                if date is None:
+                    continue  # Skip events without valid dates
+                event_date = datetime.fromisoformat(date)
             
             # Format date as dd/mm/yyyy
-            formatted_date = event_date.strftime('%d/%m/%Y')
+            formatted_date = f"{event_date.day:02d}/{event_date.month:02d}/{event_date.year:04d}"
             
             # Extract patient name and check if it's a parent session
-            patient_name, is_parent_session = self.extract_patient_name(event_title)
+            patient_name, is_parent_session = _extract_patient_name(event_title)
             
             if not patient_name:
                 continue  # Skip events without valid patient names
             
-            # Initialize calendar data if not exists
-            if calendar_id not in processed_data:
-                processed_data[calendar_id] = {
-                    'calendar_name': calendar_name,
-                    'patients': {}
-                }
-            
-            # Initialize patient data if not exists
-            if patient_name not in processed_data[calendar_id]['patients']:
-                processed_data[calendar_id]['patients'][patient_name] = {
-                    'total_sessions': 0,
-                    'sessions': []
-                }
+            # Calendar and patient entries are created on first access
+            calendar_data = processed_data[calendar_id]
+            calendar_data['calendar_name'] = calendar_name
+            patient_data = calendar_data['patients'][patient_name]
             
             # Add session data
             session_data = {
                 'date': formatted_date,
+                'sort_key': event_date.toordinal(),
                 'title': event_title,
                 'is_parent_session': is_parent_session
             }
             
-            processed_data[calendar_id]['patients'][patient_name]['sessions'].append(session_data)
-            processed_data[calendar_id]['patients'][patient_name]['total_sessions'] += 1
+            patient_data['sessions'].append(session_data)
         
         return processed_data
     
@@ -150,7 +172,7 @@ class DataProcessor:
                 totales_data.append({
                     'calendario': calendar_name,
                     'nombre': patient_name,
-                    'total': patient_data['total_sessions']
+                    'total': len(patient_data['sessions'])
                 })
         
         # Sort by calendar name, then by patient name
@@ -189,24 +211,24 @@ class DataProcessor:
                 
                 for session in patient_data['sessions']:
                     if session['is_parent_session']:
-                        parent_sessions.append(session['date'])
+                        parent_sessions.append(session)
                     else:
-                        regular_sessions.append(session['date'])
+                        regular_sessions.append(session)
                 
                 # Add regular sessions if any
                 if regular_sessions:
-                    regular_sessions.sort(key=lambda x: datetime.strptime(x, '%d/%m/%Y'))
+                    regular_sessions.sort(key=lambda x: x['sort_key'])
                     detalle_data[calendar_name].append({
                         'patient_name': patient_name,
-                        'dates': regular_sessions
+                        'dates': [session['date'] for session in regular_sessions]
                     })
                 
                 # Add parent sessions if any (show as "Padres de [Name]")
                 if parent_sessions:
-                    parent_sessions.sort(key=lambda x: datetime.strptime(x, '%d/%m/%Y'))
+                    parent_sessions.sort(key=lambda x: x['sort_key'])
                     detalle_data[calendar_name].append({
                         'patient_name': f'Padres de {patient_name}',
-                        'dates': parent_sessions
+                        'dates': [session['date'] for session in parent_sessions]
                     })
             
             # Sort patients by name within each calendar
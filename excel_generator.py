@@ -3,15 +3,24 @@ Excel report generation module for GCal Extractor.
 Creates Excel files with 'totales' and 'detalle' sheets.
 """
 
-import pandas as pd
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils.dataframe import dataframe_to_rows
+from openpyxl.utils import get_column_letter
 from datetime import datetime
-from typing import List, Dict
+from io import BytesIO
+from itertools import zip_longest
+from typing import List, Dict, Optional, Tuple
 import os
 import streamlit as st
 
+# Shared header styles; openpyxl dedupes them in the workbook style table
+_HEADER_FONT = Font(bold=True)
+_TOTALES_FILL = PatternFill(start_color="E6E6FA", end_color="E6E6FA", fill_type="solid")
+_DETALLE_FILL = PatternFill(start_color="FFE4B5", end_color="FFE4B5", fill_type="solid")
+_CAL_FILL = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
+_CENTER = Alignment(horizontal="center")
+
 
 class ExcelGenerator:
     """Handles Excel report generation with dual sheets."""
@@ -28,107 +37,99 @@ class ExcelGenerator:
     
     def create_totales_sheet(self, workbook: Workbook, totales_data: List[Dict]):
         """Create 'totales' sheet with calendar, patient name, and total columns."""
-        ws = workbook.active
-        ws.title = "totales"
+        ws = workbook.create_sheet(title="totales")
+        
+        headers = ['calendario', 'nombre', 'total']
         
-        # Create DataFrame
-        df = pd.DataFrame(totales_data)
+        # Track column widths while building rows
+        widths = [len(header) for header in headers]
+        rows = []
+        for row_data in totales_data:
+            row = (row_data['calendario'], row_data['nombre'], row_data['total'])
+            for i, value in enumerate(row):
+                widths[i] = max(widths[i], len(str(value)))
+            rows.append(row)
+        
+        # Column widths must be set before the first row is streamed
+        for col_num, width in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(col_num)].width = min(width + 2, 50)
         
         # Add headers
-        headers = ['calendario', 'nombre', 'total']
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill(start_color="E6E6FA", end_color="E6E6FA", fill_type="solid")
-            cell.alignment = Alignment(horizontal="center")
+        header_cells = []
+        for header in headers:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.font = _HEADER_FONT
+            cell.fill = _TOTALES_FILL
+            cell.alignment = _CENTER
+            header_cells.append(cell)
+        ws.append(header_cells)
         
         # Add data
-        for row_num, row_data in enumerate(totales_data, 2):
-            ws.cell(row=row_num, column=1, value=row_data['calendario'])
-            ws.cell(row=row_num, column=2, value=row_data['nombre'])
-            ws.cell(row=row_num, column=3, value=row_data['total'])
-        
-        # Auto-adjust column widths
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
+        for row in rows:
+            ws.append(row)
     
     def create_detalle_sheet(self, workbook: Workbook, detalle_data: Dict[str, List[Dict]]):
         """Create 'detalle' sheet with patient columns and consultation dates."""
         ws = workbook.create_sheet(title="detalle")
         
-        current_col = 1
+        patient_headers = []
+        calendar_headers = []
+        date_columns = []
+        widths = []
         
         for calendar_name, patients in detalle_data.items():
             if not patients:
                 continue
             
-            # Add calendar name header (spans across patient columns)
-            start_col = current_col
+            start_col = len(date_columns) + 1
             
             # Add patient headers
-            patient_cols = []
             for patient in patients:
-                patient_name = patient['patient_name']
-                
-                # Write patient name header
-                cell = ws.cell(row=1, column=current_col, value=patient_name)
-                cell.font = Font(bold=True)
-                cell.fill = PatternFill(start_color="FFE4B5", end_color="FFE4B5", fill_type="solid")
-                cell.alignment = Alignment(horizontal="center")
-                
-                patient_cols.append(current_col)
-                current_col += 1
+                cell = WriteOnlyCell(ws, value=patient['patient_name'])
+                cell.font = _HEADER_FONT
+                cell.fill = _DETALLE_FILL
+                cell.alignment = _CENTER
+                patient_headers.append(cell)
+                date_columns.append(patient['dates'])
+                widths.append(max([len(patient['patient_name'])] + [len(date) for date in patient['dates']]))
             
             # Add calendar name header spanning patient columns
-            if len(patient_cols) > 1:
-                ws.merge_cells(start_row=2, start_column=start_col, 
-                              end_row=2, end_column=current_col-1)
+            end_col = len(date_columns)
+            if end_col > start_col:
+                ws.merged_cells.add(f"{get_column_letter(start_col)}2:{get_column_letter(end_col)}2")
             
-            calendar_cell = ws.cell(row=2, column=start_col, value=calendar_name)
-            calendar_cell.font = Font(bold=True)
-            calendar_cell.fill = PatternFill(start_color="D3D3D3", end_color="D3D3D3", fill_type="solid")
-            calendar_cell.alignment = Alignment(horizontal="center")
-            
-            # Add patient dates
-            for i, patient in enumerate(patients):
-                col = patient_cols[i]
-                dates = patient['dates']
-                
-                for row_num, date in enumerate(dates, 3):
-                    ws.cell(row=row_num, column=col, value=date)
+            calendar_cell = WriteOnlyCell(ws, value=calendar_name)
+            calendar_cell.font = _HEADER_FONT
+            calendar_cell.fill = _CAL_FILL
+            calendar_cell.alignment = _CENTER
+            calendar_headers.append(calendar_cell)
+            calendar_headers.extend([None] * (end_col - start_col))
+            widths[start_col - 1] = max(widths[start_col - 1], len(calendar_name))
+        
+        # Column widths must be set before the first row is streamed
+        for col_num, width in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(col_num)].width = min(max(width + 2, 12), 20)
+        
+        if not date_columns:
+            return
         
-        # Auto-adjust column widths
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if cell.value and len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max(max_length + 2, 12), 20)
-            ws.column_dimensions[column_letter].width = adjusted_width
+        ws.append(patient_headers)
+        ws.append(calendar_headers)
+        
+        # Add patient dates, one row at a time across all patient columns
+        for row in zip_longest(*date_columns):
+            ws.append(row)
     
     def generate_excel_report(self, totales_data: List[Dict], detalle_data: Dict[str, List[Dict]], 
-                            year: int, month: int) -> str:
+                            year: int, month: int) -> Optional[Tuple[str, bytes]]:
         """
         Generate complete Excel report with both sheets.
         
-        Returns the filepath of the generated Excel file.
+        Returns a (filepath, file contents) tuple for the generated Excel file.
         """
         try:
-            # Create workbook
-            workbook = Workbook()
+            # Create workbook in streaming mode
+            workbook = Workbook(write_only=True)
             
             # Create totales sheet
             self.create_totales_sheet(workbook, totales_data)
@@ -140,9 +141,15 @@ class ExcelGenerator:
             filename = self.generate_timestamped_filename(year, month)
             filepath = os.path.join(self.reports_dir, filename)
             
-            workbook.save(filepath)
+            # Serialize once; the same bytes are saved to disk and offered for download
+            buffer = BytesIO()
+            workbook.save(buffer)
+            report_bytes = buffer.getvalue()
+            
+            with open(filepath, 'wb') as f:
+                f.write(report_bytes)
             
-            return filepath
+            return filepath, report_bytes
             
         except Exception as e:
             st.error(f"Error generating Excel report: {e}")
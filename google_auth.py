@@ -3,13 +3,18 @@ Google OAuth 2.0 authentication module for GCal Extractor.
 Handles OAuth flow, token management, and automatic refresh.
 """
 
-import json
+import hashlib
+import logging
 import os
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 import streamlit as st
+import json_utils
+
+logger = logging.getLogger(__name__)
 
 # OAuth 2.0 scopes for Google Calendar
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
@@ -19,6 +24,28 @@ CREDENTIALS_FILE = 'credentials.json'
 
 TOKEN_FILE = 'tokens.json'
 
+# Fernet key used to encrypt tokens.json at rest; stored as plaintext JSON when unset
+TOKEN_KEY_ENV = 'GCAL_TOKEN_KEY'
+
+# Show OAuth debugging output in the UI when GCAL_DEBUG=1
+_DEBUG = os.environ.get("GCAL_DEBUG") == "1"
+
+# Tokens this close to expiry are refreshed in the background while still in use.
+# google-auth already treats tokens as expired ~4 minutes early, so this must be larger.
+TOKEN_STALE_MARGIN = timedelta(minutes=10)
+
+
+@lru_cache(maxsize=1)
+def _get_token_cipher():
+    """Get the Fernet cipher for the token file, or None when encryption is disabled."""
+    key = os.environ.get(TOKEN_KEY_ENV)
+    if not key:
+        return None
+    
+    # Optional dependency, only needed when token encryption is enabled
+    from cryptography.fernet import Fernet
+    return Fernet(key.encode('utf-8'))
+
 
 class GoogleAuth:
     """Handles Google OAuth authentication and token management."""
@@ -26,45 +53,108 @@ class GoogleAuth:
     def __init__(self):
         self.credentials = None
         self.service = None
+        # Whether the token file has already been read in this session
+        self.credentials_loaded = False
+        # Held while a token refresh is in progress, so only one runs at a time
+        self._refresh_lock = threading.Lock()
         
     def load_credentials(self):
         """Load existing credentials from token file."""
-        if os.path.exists(TOKEN_FILE):
-            try:
-                self.credentials = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-                return True
-            except Exception as e:
-                st.error(f"Error loading credentials: {e}")
-                return False
-        return False
+        self.credentials_loaded = True
+        try:
+            with open(TOKEN_FILE, 'rb') as f:
+                token_data = f.read()
+            
+            # Plaintext token files from before encryption was enabled are still accepted
+            cipher = _get_token_cipher()
+            if cipher and not token_data.lstrip().startswith(b'{'):
+                token_data = cipher.decrypt(token_data)
+            
+            token_info = json_utils.loads(token_data)
+            self.credentials = Credentials.from_authorized_user_info(token_info, SCOPES)
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            st.error(f"Error loading credentials: {e}")
+            return False
     
     def save_credentials(self):
         """Save credentials to token file."""
         if self.credentials:
             try:
-                with open(TOKEN_FILE, 'w') as token:
-                    token.write(self.credentials.to_json())
+                self._write_credentials(self.credentials)
                 return True
             except Exception as e:
                 st.error(f"Error saving credentials: {e}")
                 return False
         return False
     
+    def _write_credentials(self, credentials):
+        """Write credentials to the token file, encrypted when a key is set; raises on failure."""
+        token_data = credentials.to_json().encode('utf-8')
+        
+        cipher = _get_token_cipher()
+        if cipher:
+            token_data = cipher.encrypt(token_data)
+        
+        json_utils.write_atomic(TOKEN_FILE, token_data)
+    
     def refresh_credentials(self):
         """Refresh expired credentials."""
-        if self.credentials and self.credentials.expired and self.credentials.refresh_token:
-            try:
-                self.credentials.refresh(Request())
-                self.save_credentials()
+        # Wait for any background refresh instead of refreshing twice
+        with self._refresh_lock:
+            if self.credentials and not self.credentials.expired:
                 return True
-            except Exception as e:
-                st.error(f"Error refreshing credentials: {e}")
-                return False
+            
+            if self.credentials and self.credentials.refresh_token:
+                try:
+                    self.credentials.refresh(Request())
+                    self.save_credentials()
+                    return True
+                except Exception as e:
+                    st.error(f"Error refreshing credentials: {e}")
+                    return False
         return False
     
+    def is_token_stale(self):
+        """Check if the still-valid token is close enough to expiry to refresh early."""
+        if not self.credentials or not self.credentials.refresh_token or not self.credentials.expiry:
+            return False
+        
+        # google-auth stores expiry as a naive UTC datetime
+        return self.credentials.expiry - datetime.utcnow() < TOKEN_STALE_MARGIN
+    
+    def start_background_refresh(self):
+        """Refresh a stale token on a background thread, unless one is already running."""
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+        
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+        return True
+    
+    def _background_refresh(self):
+        """Refresh credentials off the request path; releases the refresh lock."""
+        try:
+            credentials = self.credentials
+            if credentials:
+                credentials.refresh(Request())
+                # Don't write back credentials that were logged out or replaced
+                # meanwhile, or the old user's token file would be recreated
+                if self.credentials is not credentials:
+                    return
+                # No ScriptRunContext on this thread, so st.error would be dropped;
+                # failures are logged below instead
+                self._write_credentials(credentials)
+        except Exception:
+            # Leave the token as is; refresh_credentials() retries once it expires
+            logger.warning("Background token refresh failed", exc_info=True)
+        finally:
+            self._refresh_lock.release()
+    
     def is_authenticated(self):
         """Check if user is authenticated with valid credentials."""
-        if not self.credentials:
+        if not self.credentials and not self.credentials_loaded:
             self.load_credentials()
         
         if not self.credentials:
@@ -73,19 +163,19 @@ class GoogleAuth:
         if self.credentials.expired:
             if not self.refresh_credentials():
                 return False
+        elif self.is_token_stale():
+            self.start_background_refresh()
         
         return self.credentials.valid
     
     def load_client_config(self):
         """Load OAuth client configuration from credentials file."""
-        if not os.path.exists(CREDENTIALS_FILE):
+        try:
+            with open(CREDENTIALS_FILE, 'rb') as f:
+                return json_utils.loads(f.read())
+        except FileNotFoundError:
             st.error(f"Credentials file '{CREDENTIALS_FILE}' not found. Please follow the setup guide.")
             return None
-        
-        try:
-            with open(CREDENTIALS_FILE, 'r') as f:
-                import json
-                return json.load(f)
         except Exception as e:
             st.error(f"Error loading credentials file: {e}")
             return None
@@ -98,13 +188,21 @@ class GoogleAuth:
                 return False
             
             # Use InstalledAppFlow for desktop authentication
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_config(client_config, SCOPES)
             
             # Run local server for OAuth callback
-            self.credentials = flow.run_local_server(port=0)
+            credentials = flow.run_local_server(port=0)
             
-            # Save credentials
-            if self.save_credentials():
+            # Wait for any background refresh so it can't overwrite the new token
+            with self._refresh_lock:
+                self.credentials = credentials
+                self.service = None
+                saved = self.save_credentials()
+            
+            if saved:
+                st.session_state.pop('_auth_check_cached', None)
+                st.session_state.pop('user_info', None)
                 st.success("Authentication successful!")
                 return True
             else:
@@ -113,8 +211,7 @@ class GoogleAuth:
                 
         except Exception as e:
             st.error(f"Error during authentication: {e}")
-            import traceback
-            st.error(f"Full error: {traceback.format_exc()}")
+            logger.exception("Error during authentication")
             return False
     
     def handle_oauth_callback(self, authorization_code):
@@ -127,17 +224,23 @@ class GoogleAuth:
             flow = st.session_state['oauth_flow']
             
             # Debug information
-            st.write(f"Debug - Authorization code received: {authorization_code[:20]}...")
+            if _DEBUG:
+                st.write(f"Debug - Authorization code received: {authorization_code[:20]}...")
             
             flow.fetch_token(code=authorization_code)
             
-            self.credentials = flow.credentials
+            with self._refresh_lock:
+                self.credentials = flow.credentials
+                self.service = None
             
             # Debug: Check if credentials are valid
-            st.write(f"Debug - Credentials valid: {self.credentials.valid}")
-            st.write(f"Debug - Token exists: {bool(self.credentials.token)}")
+            if _DEBUG:
+                st.write(f"Debug - Credentials valid: {self.credentials.valid}")
+                st.write(f"Debug - Token exists: {bool(self.credentials.token)}")
             
             if self.save_credentials():
+                st.session_state.pop('_auth_check_cached', None)
+                st.session_state.pop('user_info', None)
                 st.success("Credentials saved successfully!")
             else:
                 st.error("Failed to save credentials")
@@ -149,21 +252,28 @@ class GoogleAuth:
             return True
         except Exception as e:
             st.error(f"Error handling OAuth callback: {e}")
-            import traceback
-            st.error(f"Full error: {traceback.format_exc()}")
+            logger.exception("Error handling OAuth callback")
             return False
     
     def logout(self):
         """Logout user by removing stored credentials."""
         try:
-            if os.path.exists(TOKEN_FILE):
-                os.remove(TOKEN_FILE)
-            self.credentials = None
-            self.service = None
+            # Wait for any background refresh so it can't write the token file back
+            with self._refresh_lock:
+                try:
+                    os.remove(TOKEN_FILE)
+                except FileNotFoundError:
+                    pass
+                self.credentials = None
+                self.service = None
+                self.credentials_loaded = False
             
             # Clear session state
             if 'oauth_flow' in st.session_state:
                 del st.session_state['oauth_flow']
+            st.session_state.pop('_auth_check_cached', None)
+            st.session_state.pop('user_info', None)
+            st.session_state.pop('events_cache', None)
             
             return True
         except Exception as e:
@@ -172,31 +282,55 @@ class GoogleAuth:
     
     def get_calendar_service(self):
         """Get authenticated Google Calendar service."""
+        # An already built service only needs its in-memory token checked
+        if self.service and self.credentials and self.credentials.valid:
+            return self.service
+        
         if not self.is_authenticated():
             return None
         
         try:
             if not self.service:
-                self.service = build('calendar', 'v3', credentials=self.credentials)
+                # Imported here: googleapiclient is slow to import and
+                # unauthenticated sessions never need it
+                from googleapiclient.discovery import build
+                
+                # Built once per session: the client wraps a single httplib2.Http,
+                # which is not thread-safe, so it must not be shared across sessions.
+                # The bundled discovery document avoids a network request.
+                self.service = build('calendar', 'v3', credentials=self.credentials,
+                                     cache_discovery=False, static_discovery=True)
             return self.service
         except Exception as e:
             st.error(f"Error creating calendar service: {e}")
             return None
     
+    def get_cache_key(self):
+        """Get a stable key identifying the authenticated user, for per-user caches."""
+        if not self.credentials:
+            return None
+        
+        # Hash the refresh token so the secret itself is never used as a cache key
+        secret = self.credentials.refresh_token or self.credentials.token or ''
+        return hashlib.sha256(secret.encode()).hexdigest()
+    
     def get_user_info(self):
         """Get basic user information."""
-        if not self.is_authenticated():
-            return None
+        # Reuse the result from an earlier rerun of this session
+        if 'user_info' in st.session_state:
+            return st.session_state['user_info']
         
         try:
+            # Returns None unless authenticated
             service = self.get_calendar_service()
             if service:
                 # Get primary calendar to extract user email
                 calendar = service.calendars().get(calendarId='primary').execute()
-                return {
+                st.session_state['user_info'] = {
                     'email': calendar.get('id', 'Unknown'),
                     'summary': calendar.get('summary', 'Primary Calendar')
                 }
+                return st.session_state['user_info']
         except Exception as e:
             st.error(f"Error getting user info: {e}")
         
@@ -0,0 +1,47 @@
+"""
+JSON serialization and file helpers for GCal Extractor.
+Uses orjson when it is installed and falls back to the standard library.
+"""
+
+import json
+import os
+import tempfile
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: bytes):
+    """Parse a JSON document from bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent: bool = False) -> bytes:
+    """Serialize an object to JSON bytes, optionally indented by 2 spaces."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+    return json.dumps(obj, indent=2 if indent else None).encode('utf-8')
+
+
+def write_atomic(path: str, data: bytes):
+    """
+    Write bytes to a file via a temporary file and an atomic rename.
+    
+    Readers never see a partially written file, and concurrent writers each
+    use their own temporary file; no fsync is issued.
+    """
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.',
+                                     prefix=f"{os.path.basename(path)}.",
+                                     suffix='.tmp', delete=False) as f:
+        tmp_path = f.name
+        try:
+            f.write(data)
+        except BaseException:
+            f.close()
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, path)
@@ -3,12 +3,24 @@ GCal Extractor - Main Streamlit Application
 Psychology consultation frequency analyzer for Google Calendar events.
 """
 
+from collections import OrderedDict
 import streamlit as st
 from google_auth import GoogleAuth
 from calendar_service import CalendarService
 from data_processor import DataProcessor
 from excel_generator import ExcelGenerator
 
+# Number of (calendars, year, month) event lists kept per session
+EVENTS_CACHE_SIZE = 8
+
+# Report period options
+_MONTHS = tuple(range(1, 13))
+_MONTH_NAMES = (
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December"
+)
+_YEARS = tuple(range(2020, 2026))
+
 # Page configuration
 st.set_page_config(
     page_title="GCal Extractor",
@@ -17,16 +29,36 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def _get_data_processor():
+    """Get the DataProcessor shared by all sessions."""
+    return DataProcessor()
+
+@st.cache_resource
+def _get_excel_generator():
+    """Get the ExcelGenerator shared by all sessions."""
+    return ExcelGenerator()
+
 def init_session_state():
     """Initialize session state variables."""
+    # GoogleAuth and CalendarService hold the user's credentials and calendar
+    # selection, so they must stay per-session; st.cache_resource is shared
+    # across all sessions and would leak one user's state to another.
     if 'auth' not in st.session_state:
         st.session_state.auth = GoogleAuth()
     if 'calendar_service' not in st.session_state:
         st.session_state.calendar_service = CalendarService(st.session_state.auth)
+    # DataProcessor and ExcelGenerator are stateless, so one instance is shared
     if 'data_processor' not in st.session_state:
-        st.session_state.data_processor = DataProcessor()
+        st.session_state.data_processor = _get_data_processor()
     if 'excel_generator' not in st.session_state:
-        st.session_state.excel_generator = ExcelGenerator()
+        st.session_state.excel_generator = _get_excel_generator()
+
+def is_authenticated():
+    """Return the authentication status checked once for the current rerun."""
+    if '_auth_check_cached' not in st.session_state:
+        st.session_state['_auth_check_cached'] = st.session_state.auth.is_authenticated()
+    return st.session_state['_auth_check_cached']
 
 def render_header():
     """Render application header."""
@@ -41,7 +73,7 @@ def render_authentication_section():
     col1, col2 = st.columns([3, 1])
     
     with col1:
-        if auth.is_authenticated():
+        if is_authenticated():
             user_info = auth.get_user_info()
             if user_info:
                 st.success(f"✅ Connected to Google Calendar: {user_info['email']}")
@@ -51,7 +83,7 @@ def render_authentication_section():
             st.error("❌ Not connected to Google Calendar")
     
     with col2:
-        if auth.is_authenticated():
+        if is_authenticated():
             if st.button("🚪 Logout", type="secondary"):
                 if auth.logout():
                     st.session_state.calendar_service.clear_configuration()
@@ -83,7 +115,7 @@ def render_oauth_flow():
         with st.spinner("Opening browser for authentication..."):
             st.info("A browser window will open for Google authentication. Please complete the authorization process.")
             if auth.authenticate_desktop():
-                st.experimental_rerun()
+                st.rerun()
             else:
                 st.error("Authentication failed. Please try again.")
 
@@ -95,73 +127,121 @@ def render_calendar_setup():
     if calendar_service.has_selected_calendars():
         calendar_service.render_selected_calendars_display()
         
-        # Option to reconfigure
-        with st.expander("🔧 Reconfigure Calendar Selection"):
+        # Option to reconfigure; expander bodies always execute, so a toggle
+        # keeps the calendar list from being fetched until it is requested
+        if st.toggle("🔧 Reconfigure Calendar Selection"):
             calendar_service.render_calendar_selection_ui()
     else:
         st.info("Please select the calendars you want to analyze.")
         calendar_service.render_calendar_selection_ui()
 
+def fetch_processed_events(calendar_service, data_processor, year, month, status):
+    """
+    Fetch and process events for the selected calendars and period.
+    
+    Event pages are processed as they arrive instead of being collected
+    first. Results are cached per session for the same calendars and period.
+    Returns (processed_data, event_count).
+    """
+    cache_key = (
+        frozenset(cal['id'] for cal in calendar_service.get_selected_calendars()),
+        year,
+        month
+    )
+    events_cache = st.session_state.setdefault('events_cache', OrderedDict())
+    
+    if cache_key in events_cache:
+        events_cache.move_to_end(cache_key)
+        return events_cache[cache_key]
+    
+    event_count = 0
+    failed_calendars = []
+    
+    def stream_events():
+        nonlocal event_count
+        for events in calendar_service.fetch_events_streaming(year, month, failed_calendars):
+            event_count += len(events)
+            status.update(label=f"Fetched {event_count} events...")
+            yield from events
+    
+    processed_data = data_processor.process_events(stream_events())
+    
+    # Only cache complete periods with events so empty or partial results are retried
+    if event_count and not failed_calendars:
+        events_cache[cache_key] = (processed_data, event_count)
+        if len(events_cache) > EVENTS_CACHE_SIZE:
+            events_cache.popitem(last=False)
+    
+    return processed_data, event_count
+
 def render_main_interface():
     """Render main application interface when authenticated."""
-    calendar_service = st.session_state.calendar_service
-    data_processor = st.session_state.data_processor
-    excel_generator = st.session_state.excel_generator
-    
     # Calendar configuration section
     render_calendar_setup()
     
     st.divider()
     
     # Report generation section
+    render_report_section()
+
+def render_report_section():
+    """Render report period selection, generation and download."""
+    calendar_service = st.session_state.calendar_service
+    data_processor = st.session_state.data_processor
+    excel_generator = st.session_state.excel_generator
+    
     st.subheader("📊 Generate Report")
     
     if not calendar_service.has_selected_calendars():
         st.warning("Please select at least one calendar to generate reports.")
         return
     
-    # Month/Year selection
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        month = st.selectbox(
-            "Month",
-            options=list(range(1, 13)),
-            format_func=lambda x: [
-                "January", "February", "March", "April", "May", "June",
-                "July", "August", "September", "October", "November", "December"
-            ][x-1],
-            index=0
-        )
-    
-    with col2:
-        year = st.selectbox(
-            "Year",
-            options=list(range(2020, 2026)),
-            index=4  # Default to 2024
-        )
+    # Month/Year selection, batched in a form so changing them doesn't rerun the page
+    with st.form("report_form"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            month = st.selectbox(
+                "Month",
+                options=_MONTHS,
+                format_func=lambda x: _MONTH_NAMES[x-1],
+                index=0
+            )
+        
+        with col2:
+            year = st.selectbox(
+                "Year",
+                options=_YEARS,
+                index=4  # Default to 2024
+            )
+        
+        # Generate button
+        submitted = st.form_submit_button("📈 Generate Report", type="primary", use_container_width=True)
     
-    # Generate button
-    if st.button("📈 Generate Report", type="primary", use_container_width=True):
-        with st.spinner("Fetching calendar events..."):
-            # Fetch events
-            events = calendar_service.fetch_events(year, month)
-            
-            if not events:
-                st.error("No events found for the selected period or error fetching events.")
+    if submitted:
+        # Drop the previous report so a failed or empty run doesn't offer it again
+        st.session_state.pop('report_bytes', None)
+        st.session_state.pop('report_name', None)
+        
+        with st.status("Fetching calendar events...", expanded=True) as status:
+            try:
+                processed_data, event_count = fetch_processed_events(
+                    calendar_service, data_processor, year, month, status
+                )
+            except Exception as e:
+                status.update(label="Error fetching events", state="error")
+                st.error(f"Error fetching calendar events: {e}")
                 return
             
-            if len(events) == 0:
+            if event_count == 0:
+                status.update(label="No events found", state="complete")
                 st.warning(f"No consultation events found for {month:02d}/{year}.")
                 return
             
-            st.success(f"Found {len(events)} events. Processing data...")
-        
-        with st.spinner("Processing patient data..."):
-            # Process events into structured data
-            processed_data = data_processor.process_events(events)
+            st.write(f"Found {event_count} events.")
             
             if not processed_data:
+                status.update(label="No patient consultations found", state="complete")
                 st.warning("No valid patient consultations found in the events.")
                 return
             
@@ -169,17 +249,22 @@ def render_main_interface():
             totales_data = data_processor.generate_totales_data(processed_data)
             detalle_data = data_processor.generate_detalle_data(processed_data)
             
-            st.success("Data processed successfully!")
+            status.update(label=f"Processed {event_count} events", state="complete")
         
         with st.spinner("Generating Excel report..."):
             # Generate Excel file
-            filepath = excel_generator.generate_excel_report(
+            report = excel_generator.generate_excel_report(
                 totales_data, detalle_data, year, month
             )
             
-            if filepath:
+            if report:
+                filepath, report_bytes = report
                 st.success("Excel report generated successfully!")
                 
+                # Keep the report in memory so reruns don't read the file back
+                st.session_state['report_bytes'] = report_bytes
+                st.session_state['report_name'] = filepath.split('/')[-1]
+                
                 # Show report summary
                 summary = excel_generator.get_report_summary(totales_data, detalle_data)
                 
@@ -196,24 +281,28 @@ def render_main_interface():
                 for calendar_name, stats in summary['calendar_stats'].items():
                     st.write(f"**{calendar_name}**: {stats['patients']} patients, {stats['sessions']} sessions")
                 
-                # Download button
-                with open(filepath, 'rb') as file:
-                    st.download_button(
-                        label="📥 Download Excel Report",
-                        data=file.read(),
-                        file_name=filepath.split('/')[-1],
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        type="primary",
-                        use_container_width=True
-                    )
-                
                 st.info(f"Report saved as: `{filepath}`")
             else:
                 st.error("Failed to generate Excel report.")
+    
+    # Download button for the latest report, served from session state
+    if 'report_bytes' in st.session_state:
+        st.download_button(
+            label="📥 Download Excel Report",
+            data=st.session_state['report_bytes'],
+            file_name=st.session_state['report_name'],
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            type="primary",
+            use_container_width=True
+        )
 
 def main():
     """Main application entry point."""
     init_session_state()
+    
+    # Check authentication once per rerun; the rest of the page reuses it
+    st.session_state.pop('_auth_check_cached', None)
+    
     render_header()
     
     # Authentication status
@@ -222,7 +311,7 @@ def main():
     st.divider()
     
     # Main content based on authentication status
-    if st.session_state.auth.is_authenticated():
+    if is_authenticated():
         render_main_interface()
     else:
         render_oauth_flow()
@@ -242,13 +331,12 @@ def main():
         """)
         
         st.header("🛠️ Status")
-        auth = st.session_state.auth
         calendar_service = st.session_state.calendar_service
         
-        st.write("**Authentication:**", "✅ Connected" if auth.is_authenticated() else "❌ Not connected")
+        st.write("**Authentication:**", "✅ Connected" if is_authenticated() else "❌ Not connected")
         st.write("**Calendars:**", f"{len(calendar_service.get_selected_calendars())} selected")
         
-        if auth.is_authenticated() and calendar_service.has_selected_calendars():
+        if is_authenticated() and calendar_service.has_selected_calendars():
             st.success("Ready to generate reports!")
         else:
             st.warning("Setup required")